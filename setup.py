@@ -10,7 +10,10 @@ setup(name="prime_functions",
       packages=find_packages("src"),
       package_dir={"": "src"},
       author_email="thomas.mcsweeney1990@gmail.com",
-      install_requires=["numpy==1.20.3",
-                        "pytest==6.2.4"
-                        ],
+      install_requires=[],
+      extras_require={"sieve": ["numpy>=1.20"],
+                      "gmpy2": ["gmpy2>=2.1"],
+                      "flint": ["python-flint>=0.3"],
+                      "numba": ["numpy>=1.20", "numba>=0.53"],
+                      "test": ["pytest>=6.2", "pytest-xdist>=2.2"]},
       )
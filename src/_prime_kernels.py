@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+numba-compiled kernels for prime_functions.
+Importing numba is slow, so prime_functions only imports this module (via _numba_kernels) the first time
+a kernel is actually needed.
+"""
+
+import numpy as np
+from numba import njit
+
+
+@njit(cache=True)
+def sieve_blocks(sieve, rows, cols, steps, block_rows):
+    """
+    Crosses off sieve[rows[i]::steps[i], cols[i]] for all i, one block of rows at a time
+    so that the writes stay in cache. Updates rows in place.
+    """
+    for lo in range(0, sieve.shape[0], block_rows):
+        hi = min(lo + block_rows, sieve.shape[0])
+        for i in range(rows.shape[0]):
+            k = rows[i]
+            while k < hi:
+                sieve[k, cols[i]] = False
+                k += steps[i]
+            rows[i] = k
+
+
+@njit(cache=True)
+def mr_witnesses_u32(witnesses, d, s, n):
+    """
+    Compiled version of all(_mr_witness(a, d, s, n) for a in witnesses) for n < 2**32.
+    Products of two residues then fit in a uint64, so no 128-bit arithmetic is needed.
+    """
+    one = np.uint64(1)
+    d, n = np.uint64(d), np.uint64(n)
+    nm1 = n - one
+    for w in witnesses:
+        a = np.uint64(w) % n
+        if a <= one:
+            continue
+        x, e = one, d
+        while e:
+            if e & one:
+                x = x * a % n
+            a = a * a % n
+            e >>= one
+        if x == one or x == nm1:
+            continue
+        for _ in range(s - 1):
+            x = x * x % n
+            if x == nm1:
+                break
+        else:
+            return False
+    return True
+
+
+@njit(cache=True)
+def mul_u64(a, b):
+    """
+    Returns the high and low 64-bit words of the full product a * b of two uint64s.
+    numba has no 128-bit integers, so this is assembled from 32-bit halves.
+    """
+    lo32, k = np.uint64(0xFFFFFFFF), np.uint64(32)
+    a_lo, a_hi, b_lo, b_hi = a & lo32, a >> k, b & lo32, b >> k
+    ll, hl, lh = a_lo * b_lo, a_hi * b_lo, a_lo * b_hi
+    mid = (ll >> k) + (hl & lo32) + lh
+    return a_hi * b_hi + (hl >> k) + (mid >> k), (mid << k) | (ll & lo32)
+
+
+@njit(cache=True)
+def mont_mul(x, y, n, n_inv):
+    """
+    Montgomery product x * y / 2**64 mod n, for x, y < n odd and n_inv = n**-1 mod 2**64.
+    The low words of x * y and m * n agree by the choice of m, so REDC is a single subtraction.
+    """
+    hi, lo = mul_u64(x, y)
+    m_hi, _ = mul_u64(lo * n_inv, n)
+    return hi - m_hi if hi >= m_hi else hi - m_hi + n
+
+
+@njit(cache=True)
+def mr_witnesses_u64(witnesses, d, s, n):
+    """
+    As mr_witnesses_u32, but for odd n < 2**64, where products of residues need 128 bits.
+    Residues are kept in Montgomery form (x * 2**64 mod n), so no division is done after the setup.
+    """
+    one = np.uint64(1)
+    d, n = np.uint64(d), np.uint64(n)
+    # n**-1 mod 2**64 by Newton's iteration, each step doubling the correct low bits (from 3, as n*n = 1 mod 8).
+    n_inv = n
+    for _ in range(5):
+        n_inv *= np.uint64(2) - n * n_inv
+    # Montgomery forms of 1 and n - 1, and 2**128 mod n for converting witnesses.
+    r1 = (np.uint64(0) - n) % n
+    r2 = r1
+    for _ in range(64):
+        r2 = r2 + r2 - n if r2 >= n - r2 else r2 + r2
+    nm1 = n - r1
+    for w in witnesses:
+        a = np.uint64(w) % n
+        if a <= one:
+            continue
+        a = mont_mul(a, r2, n, n_inv)
+        x, e = r1, d
+        while e:
+            if e & one:
+                x = mont_mul(x, a, n, n_inv)
+            a = mont_mul(a, a, n, n_inv)
+            e >>= one
+        if x == r1 or x == nm1:
+            continue
+        for _ in range(s - 1):
+            x = mont_mul(x, x, n, n_inv)
+            if x == nm1:
+                break
+        else:
+            return False
+    return True
@@ -4,14 +4,126 @@
 Prime number-related functions that I've often found useful for coding challenges etc.
 """
 
-import numpy as np
-from math import sqrt, prod
+from math import sqrt, isqrt, prod, gcd
+from functools import lru_cache
+from collections import defaultdict
+from operator import index
+from bisect import bisect_right
+from numbers import Integral
+
+try:
+    import numpy as np
+except ImportError:  # numpy is optional, get_primes then needs with_numpy=False.
+    np = None
+
+try:
+    from gmpy2 import mpz, is_strong_prp, is_prime as gmpy2_is_prime
+except ImportError:  # gmpy2 is optional, fall back to pure Python witness tests.
+    mpz, is_strong_prp, gmpy2_is_prime = int, None, None
+
+try:
+    from flint import fmpz
+except ImportError:  # python-flint is optional, it only speeds up miller_rabin for n < 2**64.
+    fmpz = None
+
+# All (25) primes less than 100, and their product for trial division by a single gcd.
+_SMALL_PRIMES = (2, 3, 5, 7, 11, 13, 17, 19, 23, 29, 31, 37, 41, 43, 47,
+                 53, 59, 61, 67, 71, 73, 79, 83, 89, 97)
+_SMALL_PRIMES_SET = frozenset(_SMALL_PRIMES)
+_SMALL_PRIMORIAL = prod(_SMALL_PRIMES)
+
+# The (25) primes between 100 and 230, whose product extends the trial division for n > 2**64 when
+# the witnesses run in pure Python. Below that, or with GMP, the extra gcd costs more than it saves.
+_TRIAL_PRIMORIAL = prod((101, 103, 107, 109, 113, 127, 131, 137, 139, 149, 151, 157, 163,
+                         167, 173, 179, 181, 191, 193, 197, 199, 211, 223, 227, 229))
+
+# prime_factors trial-divides by the primes below this before switching to Pollard's rho.
+_TRIAL_LIMIT = 1000
+
+# Forisek-Jancina witnesses: for n < 2**32 (and no factors below 8), one witness test with base
+# _FJ_BASES[h], where h is a hash of n, is deterministic. 
+_FJ_BASES = (15591, 2018, 166, 7429, 8064, 16045, 10503, 4399, 1949, 1295, 2776, 3620, 560, 3128, 5212, 2657,
+             2300, 2021, 4652, 1471, 9336, 4018, 2398, 20462, 10277, 8028, 2213, 6219, 620, 3763, 4852, 5012,
+             3185, 1333, 6227, 5298, 1074, 2391, 5113, 7061, 803, 1269, 3875, 422, 751, 580, 4729, 10239,
+             746, 2951, 556, 2206, 3778, 481, 1522, 3476, 481, 2487, 3266, 5633, 488, 3373, 6441, 3344,
+             17, 15105, 1490, 4154, 2036, 1882, 1813, 467, 3307, 14042, 6371, 658, 1005, 903, 737, 1887,
+             7447, 1888, 2848, 1784, 7559, 3400, 951, 13969, 4304, 177, 41, 19875, 3110, 13221, 8726, 571,
+             7043, 6943, 1199, 352, 6435, 165, 1169, 3315, 978, 233, 3003, 2562, 2994, 10587, 10030, 2377,
+             1902, 5354, 4447, 1555, 263, 27027, 2283, 305, 669, 1912, 601, 6186, 429, 1930, 14873, 1784,
+             1661, 524, 3577, 236, 2360, 6146, 2850, 55637, 1753, 4178, 8466, 222, 2579, 2743, 2031, 2226,
+             2276, 374, 2132, 813, 23788, 1610, 4422, 5159, 1725, 3597, 3366, 14336, 579, 165, 1375, 10018,
+             12616, 9816, 1371, 536, 1867, 10864, 857, 2206, 5788, 434, 8085, 17618, 727, 3639, 1595, 4944,
+             2129, 2029, 8195, 8344, 6232, 9183, 8126, 1870, 3296, 7455, 8947, 25017, 541, 19115, 368, 566,
+             5674, 411, 522, 1027, 8215, 2050, 6544, 10049, 614, 774, 2333, 3007, 35201, 4706, 1152, 1785,
+             1028, 1540, 3743, 493, 4474, 2521, 26845, 8354, 864, 18915, 5465, 2447, 42, 4511, 1660, 166,
+             1249, 6259, 2553, 304, 272, 7286, 73, 6554, 899, 2816, 5197, 13330, 7054, 2818, 3199, 811,
+             922, 350, 7514, 4452, 3449, 2663, 4708, 418, 1621, 1171, 3471, 88, 11345, 412, 1559, 194)
+
+# Deterministic witness sets: n < _MINIMAL_BOUNDS[i] passes the witness tests for all of _MINIMAL_WITNESSES[i]
+# only if it is prime. The last set is used for n beyond all bounds. 
+# TODO: parameter specifying number of primes to use beyond the bounds?
+_MINIMAL_BOUNDS = (350269456337, 55245642489451, 7999252175582851, 585226005592931977,
+                   18446744073709551616, # 2**64
+                   318665857834031151167461, 3317044064679887385961981)
+_MINIMAL_WITNESSES = ((4230279247111683200, 14694767155120705706, 16641139526367750375),
+                      (2, 141889084524735, 1199124725622454117, 11096072698276303650),
+                      (2, 4130806001517, 149795463772692060, 186635894390467037, 3967304179347715805),
+                      (2, 123635709730000, 9233062284813009, 43835965440333360, 761179012939631437, 1263739024124850375),
+                      (2, 325, 9375, 28178, 450775, 9780504, 1795265022),
+                      _SMALL_PRIMES[:12],
+                      _SMALL_PRIMES[:13],
+                      _SMALL_PRIMES)
+
+# The classic witness sets, made up of the first few primes.
+_CLASSIC_BOUNDS = (2047, 1373653, 25326001, 3215031751, 2152302898747, 3474749660383, 341550071728321, 
+                   3825123056546413051, 318665857834031151167461, 3317044064679887385961981)
+_CLASSIC_WITNESSES = tuple(_SMALL_PRIMES[:k] for k in (1, 2, 3, 4, 5, 6, 7, 9, 12, 13, 25))
+
+# The witness sets as uint64 arrays for the compiled witness test, as numba cannot loop over tuples
+# mixing bases above and below 2**63.
+_WITNESS_ARRAYS = ({w: np.array(w, dtype=np.uint64) for w in _MINIMAL_WITNESSES + _CLASSIC_WITNESSES}
+                   if np is not None else {})
+
+# Residues mod 30 that are coprime to 30, used by the wheel sieve in get_primes.
+_WHEEL = (1, 7, 11, 13, 17, 19, 23, 29)
+_WHEEL_INDEX = {r: j for j, r in enumerate(_WHEEL)}
+
+# Rows of the wheel sieve crossed off at a time when compiled: 32 KB, about the size of an L1 data cache.
+_SIEVE_BLOCK_ROWS = 4096
+
+
+@lru_cache(maxsize=None)
+def _numba_kernels():
+    """
+    Returns the module of numba-compiled kernels, or None if numba is not installed.
+    numba is optional and slow to import (about a third of a second), so this only happens the first time
+    a kernel is needed - never, if gmpy2 or python-flint handle everything.
+    """
+    try:
+        import _prime_kernels
+    except ImportError:  # numba is optional, get_primes then sieves with NumPy slicing alone.
+        return None
+    return _prime_kernels
+
+
+def _as_int(n):
+    """
+    Returns n as an int if it is of the form n.000... etc (e.g., a float, np.float32, Decimal or Fraction),
+    else throws an error. Integer types (e.g., the NumPy integers returned by get_primes) are converted
+    exactly, since fixed-width arithmetic would overflow.
+    """
+    if isinstance(n, Integral):
+        return index(n)
+    i = int(n)
+    if abs(n - i) < 1e-6:
+        return i
+    raise ValueError("Number must be an integer!")
 
 
 def prime_factors(n):
     """
     Returns the prime factors of n.
-    Fairly fast, although e.g., sympy.ntheory.factorint is about 3x faster.
+    Uses trial division by small primes, then Pollard's rho (Brent's variant) for the rest.
 
     Parameters
     ----------
@@ -27,34 +139,77 @@ def prime_factors(n):
     if n < 0:
         raise ValueError("Number must be positive!")
 
-    # If n is float of the form n.000... etc, then convert to int, else throw an error
-    if isinstance(n, float):
-        i = int(n)
-        if abs(n - i) < 1e-6:
-            n = int(n)
-        else:
-            raise ValueError("Number must be an integer!")
+    # If n is float of the form n.000... etc, then convert to int, else throw an error.
+    n = _as_int(n)
             
-    factors = {}
-    while n > 1:
-        temp = n
-        while n % 2 == 0:
-            n = n // 2
-            try:
-                factors[2] += 1
-            except KeyError:
-                factors[2] = 1
-        for p in range(3, int(sqrt(n)) + 1, 2):
-            while n % p == 0:
-                n //= p
-                try:
-                    factors[p] += 1
-                except KeyError:
-                    factors[p] = 1
-        if n == temp: # n is prime
-            factors[n] = 1
-            n = 1
-    return factors
+    if n < 2:
+        return {}
+
+    factors = defaultdict(int)
+
+    # Trial division by small primes first.
+    for p in _trial_primes():
+        if p * p > n:
+            break
+        while n % p == 0:
+            n //= p
+            factors[p] += 1
+
+    # Split whatever is left with Pollard's rho until only primes remain.
+    rest = [n] if n > 1 else []
+    while rest:
+        m = rest.pop()
+        # m is already a validated int, so go straight to the cached test.
+        if _miller_rabin_int(m, True):
+            factors[m] += 1
+        else:
+            d = _pollard_brent(m)
+            rest += [d, m // d]
+    return dict(sorted(factors.items()))
+
+
+@lru_cache(maxsize=None)
+def _trial_primes():
+    """
+    Primes less than _TRIAL_LIMIT, sieved on first use and then cached.
+    """
+    return get_primes(_TRIAL_LIMIT, with_numpy=False)
+
+
+def _pollard_brent(n):
+    """
+    Returns a non-trivial factor of the composite n, which must have no factors less than _TRIAL_LIMIT.
+    Pollard's rho algorithm with Brent's cycle detection, taking the gcd once per batch of 128 steps.
+    
+    References
+    ------------
+    R. P. Brent, An Improved Monte Carlo Factorization Algorithm (1980)
+    """
+    c = 1
+    while True:
+        y, r, q, g = 2, 1, 1, 1
+        while g == 1:
+            x = y
+            for _ in range(r):
+                y = (y * y + c) % n
+            k = 0
+            while k < r and g == 1:
+                ys = y
+                for _ in range(min(128, r - k)):
+                    y = (y * y + c) % n
+                    q = q * abs(x - y) % n
+                g = gcd(q, n)
+                k += 128
+            r *= 2
+        if g == n:
+            # The batch overshot, so retrace it one step at a time.
+            g = 1
+            while g == 1:
+                ys = (ys * ys + c) % n
+                g = gcd(abs(x - ys), n)
+        if g != n:
+            return g
+        c += 1 # Cycle closed without a factor, try another polynomial.
 
 
 def num_divisors(n):
@@ -94,12 +249,7 @@ def proper_divisors(n):
         raise ValueError("Number must be positive!")
 
     # If n is float of the form n.000... etc, then convert to int, else throw an error.
-    if isinstance(n, float):
-        i = int(n)
-        if abs(n - i) < 1e-6:
-            n = int(n)
-        else:
-            raise ValueError("Number must be an integer!")
+    n = _as_int(n)
             
     divisors = [1]
     rt = sqrt(n)
@@ -131,12 +281,7 @@ def is_prime_trial(n):
         raise ValueError("Number must be positive!")
 
     # If n is float of the form n.000... etc, then convert to int, else throw an error.
-    if isinstance(n, float):
-        i = int(n)
-        if abs(n - i) < 1e-6:
-            n = int(n)
-        else:
-            raise ValueError("Number must be an integer!")
+    n = _as_int(n)
             
     if n in {0, 1}:
         return False
@@ -163,7 +308,7 @@ def get_primes(N, with_numpy=True):
         Limit.
     
     with_numpy : BOOL
-        If True, uses fast numpy-based method. If False, avoids it.
+        If True, uses fast numpy-based method (numpy must be installed). If False, avoids it.
         The default is True.
 
     Returns
@@ -178,19 +323,38 @@ def get_primes(N, with_numpy=True):
         raise ValueError("There are no primes smaller than 2!")
 
     # If N is float of the form n.000... etc, then convert to int, else throw an error.
-    if isinstance(N, float):
-        i = int(N)
-        if abs(N - i) < 1e-6:
-            N = int(N)
-        else:
-            raise ValueError("Number must be an integer!")
+    N = _as_int(N)
     
     if with_numpy:            
-        sieve = np.ones(N//2, dtype=bool)
-        for p in range(3, int(sqrt(N)) + 1, 2):
-            if sieve[p//2]:
-                sieve[p*p//2::p] = False
-        return np.r_[2, 2*np.nonzero(sieve)[0][1::]+1]
+        if np is None:
+            raise ImportError("numpy is needed for with_numpy=True!")
+        # Mod 30 wheel: sieve[k, j] represents 30*k + _WHEEL[j], so multiples of 2, 3 and 5 are never stored.
+        sieve = np.ones((N//30 + 1, 8), dtype=bool)
+        sieve[0, 0] = False # 1 is not prime.
+        kernels = _numba_kernels()
+        if kernels is None:
+            for p in range(7, int(sqrt(N)) + 1):
+                j = _WHEEL_INDEX.get(p % 30)
+                if j is None or not sieve[p//30, j]:
+                    continue
+                for k, c in _wheel_starts(p):
+                    sieve[k::p, c] = False
+        else:
+            # Sieving primes up to sqrt(N) come from a small list-based sieve, then the rest is done in blocks.
+            base = [p for p in get_primes(isqrt(N) + 2, with_numpy=False) if p >= 7]
+            starts = [start for p in base for start in _wheel_starts(p)]
+            rows = np.array([k for k, _ in starts], dtype=np.int64)
+            cols = np.array([c for _, c in starts], dtype=np.int64)
+            steps = np.repeat(np.array(base, dtype=np.int64), 8)
+            kernels.sieve_blocks(sieve, rows, cols, steps, _SIEVE_BLOCK_ROWS)
+        # Map (row, column) indices back to numbers in place.
+        primes = np.flatnonzero(sieve)
+        residues = np.array(_WHEEL)[primes & 7]
+        primes >>= 3
+        primes *= 30
+        primes += residues
+        primes = primes[:np.searchsorted(primes, N)]
+        return np.r_[[p for p in (2, 3, 5) if p < N], primes]
     
     sieve = [True] * (N//2)
     for p in range(3, int(sqrt(N)) + 1, 2):
@@ -199,10 +363,54 @@ def get_primes(N, with_numpy=True):
     return [2] + [2*p+1 for p in range(1, N//2) if sieve[p]]
 
 
+def _wheel_starts(p):
+    """
+    Multiples p*q of p with q >= p and q coprime to 30 fall into each column of the wheel sieve every p rows.
+    Returns the (row, column) of the first of them in each of the 8 columns.
+    """
+    starts = []
+    for r in _WHEEL:
+        k, m = divmod(p * (p + (r - p) % 30), 30)
+        starts.append((k, _WHEEL_INDEX[m]))
+    return starts
+
+
+def _mr_witness(a, d, s, n):
+    """
+    Returns True if n passes the witness test, with a as witness - i.e., n may be prime.
+    Returns False if it fails the test and is definitely composite.
+    Here n - 1 = 2**s * d with d odd; d and s are not needed if gmpy2 is installed.
+    """
+    # Witnesses may be larger than n. If n divides a then a tells us nothing.
+    a %= n
+    if a in {0, 1}:
+        return True
+    if is_strong_prp is not None:
+        try:
+            return is_strong_prp(n, a)
+        except ValueError:  # gcd(n, a) > 1, so n is composite.
+            return False
+    nm1 = n - 1
+    x = pow(a, d, n)
+    if x == 1 or x == nm1:
+        return True
+    for _ in range(s - 1):
+        x = (x * x) % n
+        if x == nm1:
+            return True
+    return False
+
+
 def miller_rabin(n, minimal=True):
     """
     Miller-Rabin primality test.
     Uses known deterministic set of witnesses for n < ~ 10^24. 
+    Witness tests are done by GMP (gmpy2.is_strong_prp) if gmpy2 is installed, and beyond the 
+    deterministic witness sets GMP's own test (Baillie-PSW plus a random base) is used instead.
+    Otherwise witness tests for n < 2**64 are compiled with numba if it is installed.
+    If python-flint is installed, n < 2**64 is handed to FLINT's n_is_prime instead. 
+    Results for the 10000 most recent arguments are cached (after conversion to int, so e.g. 13 and
+    13.0000001 share a cache entry).
 
     Parameters
     ----------
@@ -225,102 +433,107 @@ def miller_rabin(n, minimal=True):
     http://rosettacode.org/wiki/Miller%E2%80%93Rabin_primality_test#Python
     https://oeis.org/A014233
     http://miller-rabin.appspot.com/
+    M. Forisek and J. Jancina, Fast Primality Testing for Integers That Fit into a Machine Word (2015)
     """
-
-    def maybe_prime(a, exp):
-        """
-        Returns True if n passes the witness test, with a as witness - i.e., n may be prime.
-        Returns False if it fails the test and is definitely composite.
-        """
-        x = pow(a, exp, n) 
-        if x in {1, n - 1}:
-            return True
-        for _ in range(r - 1):
-            x = (x * x) % n
-            if x == n - 1:
-                return True
-        return False
-
     # Check for input errors.
     if n < 0:
         raise ValueError("Number must be positive!")
 
     # If n is float of the form n.000... etc, then convert to int, else throw an error.
-    if isinstance(n, float):
-        i = int(n)
-        if abs(n - i) < 1e-6:
-            n = int(n)
-        else:
-            raise ValueError("Number must be an integer!")
+    n = _as_int(n)
+
+    return _miller_rabin_int(n, bool(minimal))
+
+
+def miller_rabin_unsafe(n, minimal=True):
+    """
+    As miller_rabin, but without any input checks or conversion, for callers that already have a
+    non-negative Python int. Results are undefined for anything else (e.g., floats or NumPy integers).
+
+    Parameters
+    ----------
+    n : INT
+        The number to check if prime.
+
+    minimal : BOOL
+        As for miller_rabin. The default is True.
+
+    Returns
+    -------
+    BOOL
+        True if prime, False otherwise.
+    """
+    return _miller_rabin_int(n, minimal)
+
+
+@lru_cache(maxsize=10000)
+def _miller_rabin_int(n, minimal):
+    """
+    Miller-Rabin test proper for validated input, with results cached.
+
+    Parameters
+    ----------
+    n : INT
+        The number to check if prime. Must be a non-negative int.
+
+    minimal : BOOL
+        As for miller_rabin.
 
+    Returns
+    -------
+    BOOL
+        True if prime, False otherwise.
+    """
     # Handle n = 0 and n = 1 separately (loops forever otherwise).
     if n in {0, 1}:
         return False
+
+    # FLINT runs its own deterministic test for n < 2**64 entirely in C.
+    if fmpz is not None and n < 18446744073709551616:
+        return bool(fmpz(n).is_prime())
     
-    # Get all (25) primes less than 100.
-    # TODO: pow in maybe_prime needs np.int64s from get_primes converted to ints. 
-    primes = [int(p) for p in get_primes(100)]
+    # Check against small set of known primes. 
+    # n has one of them as a factor iff it shares a factor with their product.
+    if gcd(n, _SMALL_PRIMORIAL) != 1:
+        return n in _SMALL_PRIMES_SET
 
-    # Check against small set of known primes.
-    if n in primes:
-        return True
-    if any((n % p) == 0 for p in primes):
+    if is_strong_prp is None and n.bit_length() > 64 and gcd(n, _TRIAL_PRIMORIAL) != 1:
         return False
 
+    # Beyond the deterministic witness sets, GMP's test is both stronger and faster than using all small primes.
+    if gmpy2_is_prime is not None and n >= _MINIMAL_BOUNDS[-1]:
+        return bool(gmpy2_is_prime(n))
+
     # n may be prime, so start algorithm proper.
-    # Decompose n = 2**r * d + 1.
-    d, r = n - 1, 1
-    while d % 2 == 0:
-        d //= 2
-        r += 1        
+    if is_strong_prp is not None:
+        # gmpy2 decomposes n - 1 itself.
+        n, d, s = mpz(n), None, None
+    else:
+        # Decompose n = 2**s * d + 1. (m & -m) isolates the lowest set bit of m = n - 1.
+        m = n - 1
+        s = (m & -m).bit_length() - 1
+        d = m >> s
 
     # Determine the witnesses to use.
-    if minimal:
-        if n < 341531: 
-            witnesses = [9345883071009581737]
-        elif n < 1050535501:
-            witnesses = [336781006125, 9639812373923155]
-        elif n < 350269456337:
-            witnesses = [4230279247111683200, 14694767155120705706, 16641139526367750375]
-        elif n < 55245642489451:
-            witnesses = [2, 141889084524735, 1199124725622454117, 11096072698276303650]
-        elif n < 7999252175582851:
-            witnesses = [2, 4130806001517, 149795463772692060, 186635894390467037, 3967304179347715805]
-        elif n < 585226005592931977:
-            witnesses = [2, 123635709730000, 9233062284813009, 43835965440333360, 761179012939631437, 1263739024124850375]
-        elif n < 18446744073709551616: # 2**64
-            witnesses = [2, 325, 9375, 28178, 450775, 9780504, 1795265022]
-        elif n < 3825123056546413051:
-            witnesses = primes[:9]  
-        elif n < 318665857834031151167461:
-            witnesses = primes[:12]  
-        elif n < 3317044064679887385961981:
-            witnesses = primes[:13] 
-        else:  # TODO: parameter specifying number of primes to use?
-            witnesses = primes
+    if minimal and n < 4294967296: # 2**32
+        # Same 64-bit hash as the reference implementation. 
+        h = ((n >> 16) ^ n) * 0x45d9f3b & 0xFFFFFFFFFFFFFFFF
+        h = ((h >> 16) ^ h) * 0x45d9f3b & 0xFFFFFFFFFFFFFFFF
+        witnesses = (_FJ_BASES[((h >> 16) ^ h) & 255],)
+    elif minimal:
+        witnesses = _MINIMAL_WITNESSES[bisect_right(_MINIMAL_BOUNDS, n)]
     else:
-        if n < 2047:
-            witnesses = primes[:1] 
-        elif n < 1373653:
-            witnesses = primes[:2] 
-        elif n < 25326001:
-            witnesses = primes[:3] 
-        elif n < 3215031751:
-            witnesses = primes[:4] 
-        elif n < 2152302898747:
-            witnesses = primes[:5] 
-        elif n < 3474749660383:
-            witnesses = primes[:6] 
-        elif n < 341550071728321:
-            witnesses = primes[:7]  
-        elif n < 3825123056546413051:
-            witnesses = primes[:9]  
-        elif n < 318665857834031151167461:
-            witnesses = primes[:12]  
-        elif n < 3317044064679887385961981:
-            witnesses = primes[:13] 
-        else:  # TODO: parameter specifying number of primes to use?
-            witnesses = primes      
-
-    # Return True (i.e., probably prime) if all calls to maybe_prime are True, False otherwise.
-    return all(maybe_prime(a, d) for a in witnesses)
\ No newline at end of file
+        witnesses = _CLASSIC_WITNESSES[bisect_right(_CLASSIC_BOUNDS, n)]
+
+    # Return True (i.e., probably prime) if all witness tests are passed, False otherwise.
+    # Without gmpy2, the whole witness set for n < 2**64 is tested in one compiled call if numba is installed.
+    # Table witness sets are passed as arrays, so each kernel is only compiled for one type of witness set
+    # (plus the single Forisek-Jancina base) rather than once per tuple length.
+    kernels = _numba_kernels() if is_strong_prp is None and n < 18446744073709551616 else None # 2**64
+    if kernels is not None and n < 4294967296: # 2**32
+        return kernels.mr_witnesses_u32(_WITNESS_ARRAYS.get(witnesses, witnesses), d, s, n)
+    if kernels is not None:
+        if n >= 9223372036854775808: # 2**63, as numba only converts ints to int64 itself.
+            n, d = np.uint64(n), np.uint64(d)
+        return kernels.mr_witnesses_u64(_WITNESS_ARRAYS.get(witnesses, witnesses), d, s, n)
+    return all(_mr_witness(a, d, s, n) for a in witnesses)
\ No newline at end of file
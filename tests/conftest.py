@@ -0,0 +1,51 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Shared pytest configuration for the tests.
+"""
+
+import os
+import sys
+
+# prime_functions lives in src/ (which setup.py does not install as an importable module),
+# so put it on the path once here rather than relying on PYTHONPATH.
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src"))
+
+import pytest
+
+from prime_functions import prime_factors
+
+
+@pytest.fixture(scope="session")
+def small_factorizations():
+    """
+    Prime factorizations of 2 <= n < 300, for the prime_factors tests to check.
+    """
+    return {n: prime_factors(n) for n in range(2, 300)}
+
+
+@pytest.fixture(params=["default", "gmpy2", "numba", "python"])
+def backend(request, monkeypatch):
+    """
+    Runs a miller_rabin test with each way of testing witnesses, not only the fastest one installed:
+    "default" uses whatever is installed, "gmpy2" hides python-flint (which would otherwise take
+    every n < 2**64) so that gmpy2 tests the witnesses, "numba" hides gmpy2 as well so that the numba
+    kernels are used, and "python" hides numba too so that the pure Python fallback is used.
+    The cache is cleared on both sides so results never leak between backends.
+    """
+    import prime_functions
+    if request.param != "default":
+        monkeypatch.setattr(prime_functions, "fmpz", None)
+    if request.param == "gmpy2":
+        pytest.importorskip("gmpy2")
+    elif request.param != "default":
+        monkeypatch.setattr(prime_functions, "mpz", int)
+        monkeypatch.setattr(prime_functions, "is_strong_prp", None)
+        monkeypatch.setattr(prime_functions, "gmpy2_is_prime", None)
+    if request.param == "numba":
+        pytest.importorskip("numba")
+    elif request.param == "python":
+        monkeypatch.setattr(prime_functions, "_numba_kernels", lambda: None)
+    prime_functions._miller_rabin_int.cache_clear()
+    yield request.param
+    prime_functions._miller_rabin_int.cache_clear()
@@ -5,10 +5,62 @@ Test functions in src/prime_functions.py.
 """
 
 import pytest
-import numpy as np
+from math import prod
+from decimal import Decimal
+from fractions import Fraction
+
+try:
+    import numpy as np
+except ImportError:  # numpy is optional, so tests that need it are skipped without it.
+    np = None
 
 from prime_functions import prime_factors, num_divisors, proper_divisors, \
-                            is_prime_trial, get_primes, miller_rabin
+                            is_prime_trial, get_primes, miller_rabin, miller_rabin_unsafe
+
+# Known primes, extracted from this Wikipedia page:
+#     https://en.wikipedia.org/wiki/List_of_prime_numbers
+PRIMES = [2, 3, 5, 7, 11, 13, 17, 19, 23, 29, 31, 37, 41, 43, 47,
+          53, 59, 61, 67, 71, 73, 79, 83, 89, 97, # All primes less than 100
+          877, 27644437, 35742549198872617291353508656626642567, 359334085968622831041960188598043661065388726959079837, # Bell primes
+          211, 2311, 200560490131, # Euclid
+          719, 5039, 39916801, 479001599, 87178291199, 10888869450418352160768000001, 265252859812191058636308479999999,
+          263130836933693530167218012159999999, 8683317618811886495518194401279999999, # Factorial
+          257, 65537, # Fermat
+          233, 1597, 28657, 514229, 433494437, 2971215073, 99194853094755497,
+          1066340417491710595814572169, 19134702400093278081449423917, # Fibonacci
+          113, 167, 269, 389, 419, 509, 659, 839, 1049, 1259, 1889, # Highly cototient
+          593, 32993, 2097593, 8589935681, 59604644783353249, 523347633027360537213687137,
+          43143988327398957279342419750374600193, # Leyland
+          127, 8191, 131071, 524287, 2147483647, 2305843009213693951, 618970019642690137449562111,
+          162259276829213363391578010288127, 170141183460469231731687303715884105727, # Mersenne
+          1361, 2521008887, 16022236204009818131831320183, # Mills
+          239, 9369319, 63018038201, 489133282872437279, 19175002942688032928599, # Newman-Shanks-Williams
+          40487, 6692367337, # Non-generous
+          5741, 33461, 44560482149, 1746860020068409, 68480406462161287469, 13558774610046711780701,
+          4125636888562548868221559797461449,  # Pell
+          211, 2309, 2311, 30029, 200560490131, 304250263527209, 23768741896345550770650537601358309, # Primorial
+          1111111111111111111, 11111111111111111111111, # Repunit
+          683, 2731, 43691, 174763, 2796203, 715827883, 2932031007403, 768614336404564651,
+          201487636602438195784363, 845100400152152934331135470251, 56713727820156410577229101238628035243, # Wagstaff
+          383, 32212254719, 2833419889721787128217599, 195845982777569926302400511, 4776913109852041418248056622882488319 # Woodall
+          ]
+
+# Notable composites. See:
+#     https://en.wikipedia.org/wiki/Strong_pseudoprime
+#     http://www.s369624816.websitehome.co.uk/rgep/cartable.html (list of Carmichael numbers)
+#     https://math.dartmouth.edu/~carlp/PDF/paper25.pdf (strong pseudoprimes for bases 2, 3, and 5)
+# Sorted, so the cheap small cases run (and fail, with pytest -x) first.
+COMPOSITES = sorted([23**2, 233 * 239, # Simple composites
+                     561, 41041, 825265, 321197185, 5394826801, 232250619601, 9746347772161, 1436697831295441,
+                     60977817398996785, 7156857700403137441, 1791562810662585767521, 87674969936234821377601,
+                     6553130926752006031481761, 1590231231043178376951698401, 35237869211718889547310642241,
+                     32809426840359564991177172754241, 2810864562635368426005268142616001,
+                     349407515342287435050603204719587201, # Carmichael numbers
+                     25326001, 161304001, 960946321, 1157839381, 3215031751, 3697278427, 5764643587,
+                     6770862367, 14386156093, 15579919981, 18459366157, 19887974881, 21276028621, # Strong pseudoprimes for bases 2, 3, 5
+                     3825123056546413051 # Strong pseudoprime for bases 2, 3, 5, 7, 11, 13, 17, 19, and 23
+                     ])
+
 
 class TestPrimeFactors(object):
     """
@@ -58,6 +110,27 @@ class TestPrimeFactors(object):
         expected = {}
         assert actual == expected, f"prime_factors(1) returned {actual} instead of {expected}"
 
+    def test_large_composites(self):
+        """
+        Test function correctly factorizes composites with large prime factors.
+        """
+        tests = {600851475143: {71: 1, 839: 1, 1471: 1, 6857: 1},
+                 2**4 * 3 * 101**2 * 1000003: {2: 4, 3: 1, 101: 2, 1000003: 1},
+                 1000000007 * 998244353: {998244353: 1, 1000000007: 1},
+                 2**64 + 1: {274177: 1, 67280421310721: 1}}
+        for n, expected in tests.items():
+            actual = prime_factors(n)
+            assert actual == expected, f"prime_factors({n}) returned {actual} instead of {expected}"
+
+    def test_small_factorizations(self, small_factorizations):
+        """
+        Test function returns prime factors whose product is n, for all n < 300.
+        """
+        for n, factors in small_factorizations.items():
+            actual = (prod(p**e for p, e in factors.items()), all(is_prime_trial(p) for p in factors))
+            expected = (n, True)
+            assert actual == expected, f"prime_factors({n}) returned {factors}!"
+
         
 class TestNumDivisors(object):
     """
@@ -97,6 +170,15 @@ class TestNumDivisors(object):
         expected = (3, 4, 4, 3, 4, 6, 4, 4, 5, 6)
         assert actual == expected, "num_divisors was incorrect for a small composite!"
 
+    def test_small(self):
+        """
+        Test function agrees with counting divisors directly, for all 1 < n < 300.
+        """
+        for n in range(2, 300):
+            actual = num_divisors(n)
+            expected = sum(n % d == 0 for d in range(1, n + 1))
+            assert actual == expected, f"num_divisors({n}) returned {actual} instead of {expected}"
+
         
 class TestProperDivisors(object):
     """
@@ -130,6 +212,15 @@ class TestProperDivisors(object):
         actual = proper_divisors(n)
         assert actual == expected, f"proper_divisors({n}) returned {actual} instead of {expected}"
 
+    def test_small(self):
+        """
+        Test function returns each proper divisor of n exactly once, for all 1 < n < 300.
+        """
+        for n in range(2, 300):
+            actual = sorted(proper_divisors(n))
+            expected = [d for d in range(1, n) if n % d == 0]
+            assert actual == expected, f"proper_divisors({n}) returned {actual} instead of {expected}"
+
 
 class TestIsPrimeTrial(object):
     """
@@ -208,6 +299,7 @@ class TestGetPrimes(object):
         """
         Test function is valid for float input sufficiently close to integer values.  
         """
+        pytest.importorskip("numpy")
         N = 7 + 1e-10
         expected = get_primes(7)
         actual = get_primes(N)
@@ -217,7 +309,7 @@ class TestGetPrimes(object):
         """
         Test function correctly identifies all primes less than 100.
         """
-        
+        pytest.importorskip("numpy")
         primes = [2, 3, 5, 7, 11, 13, 17, 19, 23, 29, 31, 37, 41, 43, 47, 
                   53, 59, 61, 67, 71, 73, 79, 83, 89, 97]               
         expected = np.array(primes)
@@ -234,6 +326,18 @@ class TestGetPrimes(object):
         actual = get_primes(100, with_numpy=False)
         assert actual == expected, f"get_primes(100, with_numpy=False) returned {actual} instead of {expected}" 
 
+    def test_without_numpy(self, monkeypatch):
+        """
+        Test function raises an ImportError if numpy is needed but not installed, and works without it otherwise.
+        """
+        monkeypatch.setattr("prime_functions.np", None)
+        with pytest.raises(ImportError) as info:
+            get_primes(100)
+        assert info.match("numpy is needed for with_numpy=True!")
+        actual = get_primes(10, with_numpy=False)
+        expected = [2, 3, 5, 7]
+        assert actual == expected, f"get_primes(10, with_numpy=False) returned {actual} instead of {expected}"
+
 
 class TestMillerRabin(object):
     """
@@ -266,120 +370,101 @@ class TestMillerRabin(object):
         expected = miller_rabin(7)
         actual = miller_rabin(n)
         assert actual == expected, f"miller_rabin{n}) returned {actual} instead of {expected}"
-    
-    def test_primes(self):
+
+    def test_numpy_integer_input(self):
         """
-        Ensure that miller_rabin returns True for known primes.
-        Examples extracted from this Wikipedia page: 
-            https://en.wikipedia.org/wiki/List_of_prime_numbers
-        """
-        primes = [2, 3, 5, 7, 11, 13, 17, 19, 23, 29, 31, 37, 41, 43, 47,
-                  53, 59, 61, 67, 71, 73, 79, 83, 89, 97, # All primes less than 100
-                  877, 27644437, 35742549198872617291353508656626642567, 359334085968622831041960188598043661065388726959079837, # Bell primes
-                  211, 2311, 200560490131, # Euclid 
-                  719, 5039, 39916801, 479001599, 87178291199, 10888869450418352160768000001, 265252859812191058636308479999999, 
-                  263130836933693530167218012159999999, 8683317618811886495518194401279999999, # Factorial 
-                  257, 65537, # Fermat 
-                  233, 1597, 28657, 514229, 433494437, 2971215073, 99194853094755497, 
-                  1066340417491710595814572169, 19134702400093278081449423917, # Fibonacci 
-                  113, 167, 269, 389, 419, 509, 659, 839, 1049, 1259, 1889, # Highly cototient 
-                  593, 32993, 2097593, 8589935681, 59604644783353249, 523347633027360537213687137, 
-                  43143988327398957279342419750374600193, # Leyland 
-                  127, 8191, 131071, 524287, 2147483647, 2305843009213693951, 618970019642690137449562111, 
-                  162259276829213363391578010288127, 170141183460469231731687303715884105727, # Mersenne 
-                  1361, 2521008887, 16022236204009818131831320183, # Mills 
-                  239, 9369319, 63018038201, 489133282872437279, 19175002942688032928599, # Newman-Shanks-Williams 
-                  40487, 6692367337, # Non-generous 
-                  5741, 33461, 44560482149, 1746860020068409, 68480406462161287469, 13558774610046711780701, 
-                  4125636888562548868221559797461449,  # Pell 
-                  211, 2309, 2311, 30029, 200560490131, 304250263527209, 23768741896345550770650537601358309, # Primorial 
-                  1111111111111111111, 11111111111111111111111, # Repunit 
-                  683, 2731, 43691, 174763, 2796203, 715827883, 2932031007403, 768614336404564651, 
-                  201487636602438195784363, 845100400152152934331135470251, 56713727820156410577229101238628035243, # Wagstaff
-                  383, 32212254719, 2833419889721787128217599, 195845982777569926302400511, 4776913109852041418248056622882488319 # Woodall
-                  ]
-        actual = all(miller_rabin(p, minimal=True) for p in primes)
+        Test function accepts the NumPy integers returned by get_primes.
+        """
+        pytest.importorskip("numpy")
+        primes = get_primes(1000)
+        actual = all(miller_rabin(p) for p in primes) and not any(miller_rabin(p + 2 * 3 * 5 * 7) for p in primes[:3])
         expected = True
-        assert actual == expected, "miller_rabin returned False for a known prime!"  # TODO: print which ones.
-    
-    def test_primes_classic(self):
+        assert actual == expected, "miller_rabin was incorrect for a NumPy integer!"
+
+    def test_numpy_float_input(self):
         """
-        Ensure that miller_rabin returns True for known primes (with classic bases).
-        Examples extracted from this Wikipedia page: 
-            https://en.wikipedia.org/wiki/List_of_prime_numbers
-        """
-        primes = [2, 3, 5, 7, 11, 13, 17, 19, 23, 29, 31, 37, 41, 43, 47,
-                  53, 59, 61, 67, 71, 73, 79, 83, 89, 97, # All primes less than 100
-                  877, 27644437, 35742549198872617291353508656626642567, 359334085968622831041960188598043661065388726959079837, # Bell primes
-                  211, 2311, 200560490131, # Euclid 
-                  719, 5039, 39916801, 479001599, 87178291199, 10888869450418352160768000001, 265252859812191058636308479999999, 
-                  263130836933693530167218012159999999, 8683317618811886495518194401279999999, # Factorial 
-                  257, 65537, # Fermat 
-                  233, 1597, 28657, 514229, 433494437, 2971215073, 99194853094755497, 
-                  1066340417491710595814572169, 19134702400093278081449423917, # Fibonacci 
-                  113, 167, 269, 389, 419, 509, 659, 839, 1049, 1259, 1889, # Highly cototient 
-                  593, 32993, 2097593, 8589935681, 59604644783353249, 523347633027360537213687137, 
-                  43143988327398957279342419750374600193, # Leyland 
-                  127, 8191, 131071, 524287, 2147483647, 2305843009213693951, 618970019642690137449562111, 
-                  162259276829213363391578010288127, 170141183460469231731687303715884105727, # Mersenne 
-                  1361, 2521008887, 16022236204009818131831320183, # Mills 
-                  239, 9369319, 63018038201, 489133282872437279, 19175002942688032928599, # Newman-Shanks-Williams 
-                  40487, 6692367337, # Non-generous 
-                  5741, 33461, 44560482149, 1746860020068409, 68480406462161287469, 13558774610046711780701, 
-                  4125636888562548868221559797461449,  # Pell 
-                  211, 2309, 2311, 30029, 200560490131, 304250263527209, 23768741896345550770650537601358309, # Primorial 
-                  1111111111111111111, 11111111111111111111111, # Repunit 
-                  683, 2731, 43691, 174763, 2796203, 715827883, 2932031007403, 768614336404564651, 
-                  201487636602438195784363, 845100400152152934331135470251, 56713727820156410577229101238628035243, # Wagstaff
-                  383, 32212254719, 2833419889721787128217599, 195845982777569926302400511, 4776913109852041418248056622882488319 # Woodall
-                  ]
-        actual = all(miller_rabin(p, minimal=False) for p in primes)
+        Test function accepts NumPy floats of the form n.000... etc, and raises ValueErrors for them otherwise.
+        """
+        pytest.importorskip("numpy")
+        actual = miller_rabin(np.float32(7.0))
         expected = True
-        assert actual == expected, "miller_rabin(minimal=False) returned False for a known prime!"  # TODO: print which ones.    
-    
-    def test_composites(self):
+        assert actual == expected, "miller_rabin was incorrect for a NumPy float!"
+        with pytest.raises(ValueError) as info:
+            miller_rabin(np.float32(7.5))
+        assert info.match("Number must be an integer!")
+
+    def test_other_real_input(self):
+        """
+        Test function accepts other real types (Decimal, Fraction) of the form n.000... etc,
+        and raises ValueErrors for them otherwise.
         """
-        Ensure that miller_rabin returns False for notable composites. 
-        See:
-            https://en.wikipedia.org/wiki/Strong_pseudoprime
-            http://www.s369624816.websitehome.co.uk/rgep/cartable.html (list of Carmichael numbers)
-            https://math.dartmouth.edu/~carlp/PDF/paper25.pdf (strong pseudoprimes for bases 2, 3, and 5)
-        """
-        composites = [23**2, 233 * 239, # Simple composites 
-                      561, 41041, 825265, 321197185, 5394826801, 232250619601, 9746347772161, 1436697831295441,
-                      60977817398996785, 7156857700403137441, 1791562810662585767521, 87674969936234821377601,
-                      6553130926752006031481761, 1590231231043178376951698401, 35237869211718889547310642241,
-                      32809426840359564991177172754241, 2810864562635368426005268142616001, 
-                      349407515342287435050603204719587201, # Carmichael numbers
-                      25326001, 161304001, 960946321, 1157839381, 3215031751, 3697278427, 5764643587, 
-                      6770862367, 14386156093, 15579919981, 18459366157, 19887974881, 21276028621, # Strong pseudoprimes for bases 2, 3, 5
-                      3825123056546413051 # Strong pseudoprime for bases 2, 3, 5, 7, 11, 13, 17, 19, and 23 
-                      ] 
-        actual = not any(miller_rabin(c, minimal=True) for c in composites) 
+        actual = all(miller_rabin(n) for n in [Decimal(7), Fraction(7), Fraction(14, 2)])
         expected = True
-        assert actual == expected, "miller_rabin returned True for a known composite!" # TODO: print which ones. 
-    
-    def test_composites_classic(self):
-        """
-        Ensure that miller_rabin returns False for notable composites (with classic bases). 
-        See:
-            https://en.wikipedia.org/wiki/Strong_pseudoprime
-            http://www.s369624816.websitehome.co.uk/rgep/cartable.html (list of Carmichael numbers)
-            https://math.dartmouth.edu/~carlp/PDF/paper25.pdf (strong pseudoprimes for bases 2, 3, and 5)
-        """
-        composites = [23**2, 233 * 239, # Simple composites 
-                      561, 41041, 825265, 321197185, 5394826801, 232250619601, 9746347772161, 1436697831295441,
-                      60977817398996785, 7156857700403137441, 1791562810662585767521, 87674969936234821377601,
-                      6553130926752006031481761, 1590231231043178376951698401, 35237869211718889547310642241,
-                      32809426840359564991177172754241, 2810864562635368426005268142616001, 
-                      349407515342287435050603204719587201, # Carmichael numbers
-                      25326001, 161304001, 960946321, 1157839381, 3215031751, 3697278427, 5764643587, 
-                      6770862367, 14386156093, 15579919981, 18459366157, 19887974881, 21276028621, # Strong pseudoprimes for bases 2, 3, 5
-                      3825123056546413051 # Strong pseudoprime for bases 2, 3, 5, 7, 11, 13, 17, 19, and 23 
-                      ] 
-        actual = not any(miller_rabin(c, minimal=False) for c in composites) 
+        assert actual == expected, "miller_rabin was incorrect for a non-float real number!"
+        for n in [Decimal("7.1"), Fraction(71, 10)]:
+            with pytest.raises(ValueError) as info:
+                miller_rabin(n)
+            assert info.match("Number must be an integer!")
+
+    def test_near_word_size(self, backend):
+        """
+        Test function around 2**32, 2**63 and 2**64, the limits of machine-word arithmetic.
+        """
+        primes = [4294967291, 4294967311, 9223372036854775783, 9223372036854775837,
+                  18446744073709551557, 18446744073709551629]
+        composites = [65521 * 65537, 65537 * 65539, 4294967291 * 4294967279, 2**63 + 1, 2**64 - 1, 2**64 + 1]
+        for minimal in [True, False]:
+            actual = all(miller_rabin(p, minimal) for p in primes) and not any(miller_rabin(c, minimal) for c in composites)
+            expected = True
+            assert actual == expected, f"miller_rabin(minimal={minimal}) was incorrect near 2**64 ({backend})!"
+
+    def test_witness_sharing_factor_with_n(self, backend):
+        """
+        Test function when a witness is 1 mod n, or shares a factor with n, which GMP's test rejects.
+        """
+        primes = [1649873075869, 63431584411635953] # Divide a witness minus 1 from the minimal sets.
+        composites = [16241, 4294974613] # Share a factor with their Forisek-Jancina witness.
+        for minimal in [True, False]:
+            actual = all(miller_rabin(p, minimal) for p in primes) and not any(miller_rabin(c, minimal) for c in composites)
+            expected = True
+            assert actual == expected, f"miller_rabin(minimal={minimal}) was incorrect ({backend})!"
+
+    @pytest.mark.parametrize("p", PRIMES)
+    def test_primes(self, p, backend):
+        """
+        Ensure that miller_rabin returns True for known primes.
+        The inputs are known ints, so miller_rabin_unsafe is used to skip validation.
+        """
+        actual = miller_rabin_unsafe(p, minimal=True)
+        expected = True
+        assert actual == expected, f"miller_rabin_unsafe returned False for known prime {p} ({backend})!"
+
+    @pytest.mark.parametrize("p", PRIMES)
+    def test_primes_classic(self, p, backend):
+        """
+        Ensure that miller_rabin returns True for known primes (with classic bases).
+        """
+        actual = miller_rabin_unsafe(p, minimal=False)
         expected = True
-        assert actual == expected, "miller_rabin(minimal=False) returned True for a known composite!" # TODO: print which ones.
+        assert actual == expected, f"miller_rabin_unsafe(minimal=False) returned False for known prime {p} ({backend})!"
+
+    @pytest.mark.parametrize("c", COMPOSITES)
+    def test_composites(self, c, backend):
+        """
+        Ensure that miller_rabin returns False for notable composites.
+        """
+        actual = miller_rabin_unsafe(c, minimal=True)
+        expected = False
+        assert actual == expected, f"miller_rabin_unsafe returned True for known composite {c} ({backend})!"
+
+    @pytest.mark.parametrize("c", COMPOSITES)
+    def test_composites_classic(self, c, backend):
+        """
+        Ensure that miller_rabin returns False for notable composites (with classic bases).
+        """
+        actual = miller_rabin_unsafe(c, minimal=False)
+        expected = False
+        assert actual == expected, f"miller_rabin_unsafe(minimal=False) returned True for known composite {c} ({backend})!"
     
         
 